@@ -6,9 +6,12 @@ This script helps manage the processing of references in batches.
 
 import json
 import sys
+from itertools import islice
 from pathlib import Path
 from datetime import datetime
 
+from json_io import save_json
+
 
 class BatchProcessor:
     def __init__(self, base_dir='/home/user/CEMA-metadata_all'):
@@ -47,9 +50,8 @@ class BatchProcessor:
         start_line = self.progress['last_processed_line'] + 1
 
         with open(self.liste_file, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, start=1):
-                if line_num < start_line:
-                    continue
+            # Skip the already-processed lines without inspecting them
+            for line_num, line in enumerate(islice(f, start_line - 1, None), start=start_line):
                 if len(references) >= batch_size:
                     break
 
@@ -62,8 +64,7 @@ class BatchProcessor:
     def save_result(self, line_num, json_data):
         """Save a processed reference result."""
         output_file = self.json_dir / f"reference_{line_num:04d}.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=2)
+        save_json(json_data, output_file)
 
         self.progress['last_processed_line'] = max(
             self.progress['last_processed_line'], line_num
@@ -0,0 +1,97 @@
+"""
+JSON helpers shared by the reference processing scripts.
+Uses orjson when it is installed and falls back to the json module.
+"""
+
+import json
+import os
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data, indent=False):
+    """Serialize data to UTF-8 JSON bytes, optionally indented by 2 spaces."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else None)
+    if indent:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """Parse JSON from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def save_json(data, output_path):
+    """Save JSON data to file atomically, leaving identical files untouched."""
+    payload = dumps(data, indent=True)
+
+    # Skip the rewrite if the file already holds the same bytes
+    try:
+        if os.path.getsize(output_path) == len(payload):
+            with open(output_path, 'rb') as f:
+                if f.read() == payload:
+                    return
+    except FileNotFoundError:
+        pass
+
+    # Write to a temporary file first so an interrupted run never leaves a
+    # partial file that would later be counted as completed
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, output_path)
+
+
+def get_completed_jsonl(jsonl_file):
+    """Get set of reference numbers already written to a JSONL output file."""
+    completed = set()
+    if not jsonl_file.exists():
+        return completed
+
+    with open(jsonl_file, 'rb') as f:
+        for line in f:
+            try:
+                completed.add(loads(line)['line_num'])
+            except (ValueError, KeyError, TypeError):
+                # Skip a line truncated by an interrupted run
+                continue
+
+    return completed
+
+
+class JsonlWriter:
+    """Append results to a single JSON Lines file, one reference per line.
+
+    Records are {"line_num": ..., "data": ...}. With flush_each_line, every
+    record is flushed as it is written so a long run loses nothing on a crash.
+    """
+
+    def __init__(self, jsonl_file, flush_each_line=True):
+        self.file = open(jsonl_file, 'ab', buffering=1 << 20)
+        self.flush_each_line = flush_each_line
+        self.lock = threading.Lock()
+
+        # Terminate a line truncated by an interrupted run
+        if self.file.tell() > 0:
+            with open(jsonl_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write(b'\n')
+
+    def save_result(self, line_num, result):
+        line = dumps({'line_num': line_num, 'data': result})
+        with self.lock:
+            self.file.write(line + b'\n')
+            if self.flush_each_line:
+                self.file.flush()
+
+    def close(self):
+        self.file.close()
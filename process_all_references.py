@@ -2,13 +2,19 @@
 """
 Process all bibliographic references from liste-tout.txt.
 This script creates batches for Claude to process.
+
+Pass --jsonl to append the results to a single references.jsonl file instead
+of writing one JSON file per reference.
 """
 
 import json
 import sys
+from functools import partial
 from pathlib import Path
 from datetime import datetime
 
+from json_io import JsonlWriter, save_json
+
 
 def read_all_references(filepath):
     """Read all references from file."""
@@ -24,13 +30,12 @@ def read_all_references(filepath):
 def save_json_result(line_num, json_data, json_dir):
     """Save a single JSON result."""
     output_file = json_dir / f"reference_{line_num:04d}.json"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(json_data, f, ensure_ascii=False, indent=2)
+    save_json(json_data, output_file)
     return output_file
 
 
-def save_batch_results(results, json_dir, error_log):
-    """Save multiple results at once."""
+def save_batch_results(results, save_result, error_log):
+    """Save multiple results at once with save_result(line_num, json_data)."""
     success_count = 0
     error_count = 0
 
@@ -39,11 +44,11 @@ def save_batch_results(results, json_dir, error_log):
             line_num = item['line_num']
             json_data = item['data']
 
-            save_json_result(line_num, json_data, json_dir)
+            save_result(line_num, json_data)
             success_count += 1
 
             if success_count % 10 == 0:
-                print(f"Processing reference {success_count}/{len(results)}...")
+                print(f"Saved {success_count}/{len(results)} results...")
 
         except Exception as e:
             error_count += 1
@@ -57,6 +62,7 @@ def main():
     base_dir = Path('/home/user/CEMA-metadata_all')
     liste_file = base_dir / 'liste-tout.txt'
     json_dir = base_dir / 'json'
+    jsonl_file = base_dir / 'references.jsonl'
     error_log = base_dir / 'errors.log'
 
     # Create directories
@@ -81,7 +87,16 @@ def main():
             results = [results]
 
         print(f"\nReceived {len(results)} results to save...")
-        success, errors = save_batch_results(results, json_dir, error_log)
+        if '--jsonl' in sys.argv[1:]:
+            # One buffered sequential write instead of a file per reference
+            jsonl_writer = JsonlWriter(jsonl_file, flush_each_line=False)
+            try:
+                success, errors = save_batch_results(results, jsonl_writer.save_result, error_log)
+            finally:
+                jsonl_writer.close()
+        else:
+            save_result = partial(save_json_result, json_dir=json_dir)
+            success, errors = save_batch_results(results, save_result, error_log)
 
         print(f"\n{'='*60}")
         print(f"Batch complete!")
@@ -3,15 +3,26 @@
 Complete automated processing of all bibliographic references using Claude API.
 Processes all 5,083 references from liste-tout.txt with proper error handling,
 progress tracking, and automatic recovery.
+
+By default all remaining references are submitted through the Message Batches
+API. Pass --direct to send concurrent requests to the Messages API instead.
+Pass --jsonl to append results to a single references.jsonl file rather than
+one JSON file per reference.
 """
 
 import os
+import asyncio
+import hashlib
 import json
+import sqlite3
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+from json_io import JsonlWriter, dumps, get_completed_jsonl, loads, save_json
+
 try:
     import anthropic
 except ImportError:
@@ -25,16 +36,115 @@ PROMPT_FILE = Path(__file__).parent / 'prompt-CC.txt'
 with open(PROMPT_FILE, 'r', encoding='utf-8') as f:
     EXTRACTION_PROMPT = f.read()
 
+# Shared by every request; marked for prompt caching so that only the
+# reference block is new input on each call
+PROMPT_BLOCK = {"type": "text", "text": EXTRACTION_PROMPT, "cache_control": {"type": "ephemeral"}}
+
+MODEL = "claude-sonnet-4-5-20250929"
+MAX_TOKENS = 4096
+
+# Message Batches API limits
+BATCH_MAX_REQUESTS = 10000
+BATCH_POLL_INTERVAL = 60  # seconds between status checks
+
+# Maximum number of in-flight requests in --direct mode
+MAX_CONCURRENCY = 20
+
+# Account rate limits (adjust to your API tier)
+RATE_LIMIT_RPM = 1000     # requests per minute
+RATE_LIMIT_TPM = 400000   # tokens per minute
+
+# Background threads writing JSON files while requests are in flight
+IO_WORKERS = 4
+
+
+class RateLimiter:
+    """Token-bucket limiter tracking both requests and tokens per minute."""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = rpm
+        self.available_tokens = tpm
+        self.last_update = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        """Refill both buckets according to the time elapsed."""
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60)
+        self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, requests, tokens):
+        """Wait until both buckets can cover the call, then consume from them."""
+        tokens = min(tokens, self.tpm)
+        async with self.lock:
+            while True:
+                self.refill()
+                if self.available_requests >= requests and self.available_tokens >= tokens:
+                    self.available_requests -= requests
+                    self.available_tokens -= tokens
+                    return
+
+                # Sleep until the emptier bucket has refilled enough
+                wait_time = max(
+                    (requests - self.available_requests) * 60 / self.rpm,
+                    (tokens - self.available_tokens) * 60 / self.tpm
+                )
+                await asyncio.sleep(wait_time)
+
+
+class ResponseCache:
+    """SQLite-backed cache of parsed results, keyed by prompt, reference and model."""
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, json BLOB)")
+
+    @staticmethod
+    def key(reference_text):
+        return hashlib.sha256((EXTRACTION_PROMPT + reference_text + MODEL).encode('utf-8')).hexdigest()
+
+    def get(self, reference_text):
+        """Return the cached result for a reference, or None."""
+        row = self.conn.execute(
+            "SELECT json FROM cache WHERE key = ?", (self.key(reference_text),)
+        ).fetchone()
+        if row is None:
+            return None
+        return loads(row[0])
+
+    def put(self, reference_text, result):
+        """Store the parsed result for a reference."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, json) VALUES (?, ?)",
+                (self.key(reference_text), dumps(result))
+            )
+
+    def close(self):
+        self.conn.close()
 
-def read_references(filepath):
-    """Read all references from file."""
+
+def read_references(filepath, skip=frozenset()):
+    """Read references from file, leaving out the line numbers in skip.
+
+    Returns the references and the total number of references in the file.
+    """
     references = []
+    total = 0
     with open(filepath, 'r', encoding='utf-8') as f:
         for line_num, line in enumerate(f, start=1):
+            if line_num in skip:
+                total += 1
+                continue
             reference = line.strip()
             if reference:
+                total += 1
                 references.append((line_num, reference))
-    return references
+    return references, total
 
 
 def get_completed_references(json_dir):
@@ -43,47 +153,72 @@ def get_completed_references(json_dir):
     if not json_dir.exists():
         return completed
 
-    for json_file in json_dir.glob('reference_*.json'):
-        try:
-            # Extract line number from filename
-            num_str = json_file.stem.replace('reference_', '')
-            line_num = int(num_str)
-            completed.add(line_num)
-        except ValueError:
-            continue
+    # A single directory read; only file names are inspected
+    with os.scandir(json_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            if not (name.startswith('reference_') and name.endswith('.json')):
+                continue
+            try:
+                # Extract line number from filename
+                line_num = int(name[len('reference_'):-len('.json')])
+                completed.add(line_num)
+            except ValueError:
+                continue
 
     return completed
 
 
-def process_reference(client, reference_text, line_num, max_retries=3):
-    """Process a single reference using Claude API."""
-    full_prompt = f"{EXTRACTION_PROMPT}\n\n**Reference to process:**\n```\n{reference_text}\n```"
+def build_request_params(reference_text):
+    """Build the Messages API parameters for a single reference."""
+    content = [
+        PROMPT_BLOCK,
+        {"type": "text", "text": f"**Reference to process:**\n```\n{reference_text}\n```"}
+    ]
+    return {
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS,
+        "temperature": 0,
+        "messages": [{"role": "user", "content": content}]
+    }
 
-    for attempt in range(max_retries):
-        try:
-            message = client.messages.create(
-                model="claude-sonnet-4-5-20250929",
-                max_tokens=4096,
-                temperature=0,
-                messages=[{"role": "user", "content": full_prompt}]
-            )
 
-            response_text = message.content[0].text.strip()
+def parse_response(message):
+    """Extract the JSON result from a Claude message."""
+    response_text = message.content[0].text.strip()
 
-            # Remove markdown code blocks if present
-            if response_text.startswith('```'):
-                lines = response_text.split('\n')
-                response_text = '\n'.join([l for l in lines if not l.strip().startswith('```')])
+    # Remove markdown code blocks if present
+    if response_text.startswith('```'):
+        lines = response_text.split('\n')
+        response_text = '\n'.join([l for l in lines if not l.strip().startswith('```')])
 
-            # Parse JSON
-            result = json.loads(response_text)
+    # Parse JSON (orjson.JSONDecodeError subclasses json.JSONDecodeError)
+    return loads(response_text)
+
+
+async def process_reference(client, limiter, cache, reference_text, line_num, max_retries=3):
+    """Process a single reference using Claude API."""
+    cached = cache.get(reference_text)
+    if cached is not None:
+        return cached, None
+
+    params = build_request_params(reference_text)
+    prompt_len = sum(len(block["text"]) for block in params["messages"][0]["content"])
+    tokens_est = prompt_len // 4 + MAX_TOKENS
+
+    for attempt in range(max_retries):
+        try:
+            await limiter.acquire(1, tokens_est)
+            message = await client.messages.create(**params)
+            result = parse_response(message)
+            cache.put(reference_text, result)
             return result, None
 
         except anthropic.RateLimitError as e:
             if attempt < max_retries - 1:
                 wait_time = min(60, 2 ** (attempt + 2))  # 4s, 8s, 16s (capped at 60s)
                 print(f"    Rate limit hit, waiting {wait_time}s...")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
             else:
                 return None, f"Rate limit exceeded after {max_retries} attempts"
 
@@ -91,7 +226,7 @@ def process_reference(client, reference_text, line_num, max_retries=3):
             error_msg = f"JSON parsing error: {str(e)}"
             if attempt < max_retries - 1:
                 print(f"    {error_msg}, retrying...")
-                time.sleep(2)
+                await asyncio.sleep(2)
             else:
                 return None, error_msg
 
@@ -99,7 +234,7 @@ def process_reference(client, reference_text, line_num, max_retries=3):
             if attempt < max_retries - 1:
                 wait_time = 2 ** (attempt + 1)
                 print(f"    API error: {e}, retrying in {wait_time}s...")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
             else:
                 return None, f"API error: {str(e)}"
 
@@ -109,10 +244,14 @@ def process_reference(client, reference_text, line_num, max_retries=3):
     return None, "Max retries exceeded"
 
 
-def save_json(data, output_path):
-    """Save JSON data to file."""
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def json_file_saver(json_dir):
+    """Return a save_result callable writing one JSON file per reference."""
+    # Plain string prefix; no Path object is built per reference
+    prefix = os.path.join(json_dir, 'reference_')
+
+    def save_result(line_num, result):
+        save_json(result, f"{prefix}{line_num:04d}.json")
+    return save_result
 
 
 def log_error(error_log, line_num, reference, error_msg):
@@ -128,13 +267,197 @@ def save_progress(progress_file, stats):
         json.dump(stats, f, indent=2)
 
 
+def load_progress(progress_file):
+    """Load processing progress, if any."""
+    if progress_file.exists():
+        with open(progress_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_cached_results(cache, references, save_result):
+    """Save results already in the cache and return the references still to submit."""
+    uncached_refs = []
+    for line_num, reference in references:
+        result = cache.get(reference)
+        if result is None:
+            uncached_refs.append((line_num, reference))
+        else:
+            save_result(line_num, result)
+    return uncached_refs
+
+
+def submit_batches(client, references, pending_batches, progress_file):
+    """Submit references to the Message Batches API.
+
+    Each new batch is added to pending_batches (batch ID -> line numbers) and
+    saved to the progress file as soon as it is created, so a failure on a
+    later chunk never loses a batch that has already been submitted.
+    """
+    for start in range(0, len(references), BATCH_MAX_REQUESTS):
+        chunk = references[start:start + BATCH_MAX_REQUESTS]
+        batch = client.messages.batches.create(requests=[
+            {"custom_id": f"ref_{line_num:04d}", "params": build_request_params(reference)}
+            for line_num, reference in chunk
+        ])
+        print(f"  Submitted batch {batch.id} ({len(chunk)} references)")
+        pending_batches[batch.id] = [line_num for line_num, _ in chunk]
+        save_progress(progress_file, {
+            'pending_batches': pending_batches,
+            'submitted_at': datetime.now().isoformat()
+        })
+    return pending_batches
+
+
+def wait_for_batch(client, batch_id):
+    """Poll a Message Batch until it has finished processing."""
+    while True:
+        batch = client.messages.batches.retrieve(batch_id)
+        if batch.processing_status == "ended":
+            return batch
+
+        counts = batch.request_counts
+        print(f"  Batch {batch_id}: {counts.processing} processing, "
+              f"{counts.succeeded} succeeded, {counts.errored} errored")
+        time.sleep(BATCH_POLL_INTERVAL)
+
+
+def process_batches(client, cache, io_pool, batch_ids, remaining_refs, save_result, error_log):
+    """Wait for each batch to end and save its results as they stream in."""
+    refs_by_line = dict(remaining_refs)
+    writes = []
+    success_count = 0
+    error_count = 0
+
+    for batch_id in batch_ids:
+        wait_for_batch(client, batch_id)
+        print(f"  Batch {batch_id} ended, saving results...")
+
+        for entry in client.messages.batches.results(batch_id):
+            # Map the custom_id back to the line number
+            line_num = int(entry.custom_id.removeprefix('ref_'))
+            if line_num not in refs_by_line:
+                # Already saved before an interrupted run
+                continue
+            reference = refs_by_line[line_num]
+            result, error = None, None
+
+            if entry.result.type == "succeeded":
+                try:
+                    result = parse_response(entry.result.message)
+                except json.JSONDecodeError as e:
+                    error = f"JSON parsing error: {str(e)}"
+                except Exception as e:
+                    error = f"Parse error: {type(e).__name__}: {str(e)}"
+            elif entry.result.type == "errored":
+                error = f"API error: {entry.result.error.error.message}"
+            else:
+                error = f"Batch request {entry.result.type}"
+
+            if result is not None:
+                cache.put(reference, result)
+                writes.append(io_pool.submit(save_result, line_num, result))
+                success_count += 1
+            else:
+                log_error(error_log, line_num, reference, error)
+                error_count += 1
+                print(f"  ✗ Line {line_num}: {error}")
+
+        print(f"  Saved {success_count} results so far ({error_count} errors)")
+
+    # Surface any write errors
+    for write in writes:
+        write.result()
+
+    return success_count, error_count
+
+
+async def process_direct(client, cache, io_pool, remaining_refs, save_result, error_log, progress_file, completed):
+    """Process references with up to MAX_CONCURRENCY concurrent requests."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    limiter = RateLimiter(RATE_LIMIT_RPM, RATE_LIMIT_TPM)
+    writes = []
+    success_count = 0
+    error_count = 0
+    start_time = time.time()
+
+    # Requests finish out of order, so track the first line not yet handled;
+    # every line below it is done (remaining_refs is in line order)
+    finished = set()
+    next_pending = 0
+
+    async def worker(line_num, reference):
+        async with semaphore:
+            result, error = await process_reference(client, limiter, cache, reference, line_num)
+        return line_num, reference, result, error
+
+    # Save results in completion order so progress is incremental
+    tasks = [worker(line_num, reference) for line_num, reference in remaining_refs]
+    for idx, task in enumerate(asyncio.as_completed(tasks), start=1):
+        line_num, reference, result, error = await task
+
+        # Show progress every 10 references
+        if idx % 10 == 0 or idx == 1:
+            elapsed = time.time() - start_time
+            rate = idx / elapsed if elapsed > 0 else 0
+            eta_seconds = (len(remaining_refs) - idx) / rate if rate > 0 else 0
+            eta_mins = eta_seconds / 60
+
+            print(f"Processed reference {idx}/{len(remaining_refs)} (line {line_num})...")
+            print(f"  Progress: {(idx/len(remaining_refs)*100):.1f}% | "
+                  f"Rate: {rate:.1f} ref/s | ETA: {eta_mins:.1f} min")
+
+        if result is not None:
+            # Write in the background so the event loop keeps issuing requests
+            writes.append(io_pool.submit(save_result, line_num, result))
+            success_count += 1
+            if idx % 10 != 0:
+                print(f"  ✓ Line {line_num}")
+        else:
+            log_error(error_log, line_num, reference, error)
+            error_count += 1
+            print(f"  ✗ Line {line_num}: {error}")
+
+        finished.add(line_num)
+        while next_pending < len(remaining_refs) and remaining_refs[next_pending][0] in finished:
+            next_pending += 1
+
+        # Save progress periodically
+        if idx % 50 == 0:
+            if next_pending < len(remaining_refs):
+                last_processed_line = remaining_refs[next_pending][0] - 1
+            else:
+                last_processed_line = remaining_refs[-1][0]
+
+            # Make sure the results being reported are on disk
+            for write in writes:
+                write.result()
+            writes.clear()
+
+            stats = {
+                'last_processed_line': last_processed_line,
+                'total_processed': len(completed) + success_count,
+                'total_errors': error_count,
+                'last_update': datetime.now().isoformat()
+            }
+            save_progress(progress_file, stats)
+
+    # Surface any write errors
+    for write in writes:
+        write.result()
+
+    return success_count, error_count
+
+
 def main():
     # Setup paths
     base_dir = Path('/home/user/CEMA-metadata_all')
     liste_file = base_dir / 'liste-tout.txt'
     json_dir = base_dir / 'json'
+    jsonl_file = base_dir / 'references.jsonl'
     error_log = base_dir / 'errors.log'
     progress_file = base_dir / 'processing_progress.json'
+    cache_file = base_dir / 'ref_cache.db'
 
     # Create directories
     json_dir.mkdir(exist_ok=True)
@@ -153,81 +476,101 @@ def main():
         sys.exit(1)
 
     # Initialize client
-    client = anthropic.Anthropic(api_key=api_key)
+    direct = '--direct' in sys.argv[1:]
+    jsonl = '--jsonl' in sys.argv[1:]
+    if direct:
+        client = anthropic.AsyncAnthropic(api_key=api_key)
+    else:
+        client = anthropic.Anthropic(api_key=api_key)
 
-    # Read all references
+    # Check for already-completed references
+    if jsonl:
+        completed = get_completed_jsonl(jsonl_file)
+    else:
+        completed = get_completed_references(json_dir)
+
+    # Read the remaining references
     print("=" * 70)
     print("BIBLIOGRAPHIC REFERENCE PROCESSOR")
     print("=" * 70)
     print("\nReading references from liste-tout.txt...")
-    references = read_references(liste_file)
-    total_refs = len(references)
+    remaining_refs, total_refs = read_references(liste_file, skip=completed)
 
-    # Check for already-completed references
-    completed = get_completed_references(json_dir)
-    remaining_refs = [(num, ref) for num, ref in references if num not in completed]
+    # Batches submitted by an interrupted run (batch ID -> line numbers) are
+    # resumed; only the references they do not cover still need submitting
+    pending_batches = load_progress(progress_file).get('pending_batches', {})
+    covered = {line_num for lines in pending_batches.values() for line_num in lines}
+    uncovered_refs = [(num, ref) for num, ref in remaining_refs if num not in covered]
 
     print(f"Total references:      {total_refs}")
     print(f"Already processed:     {len(completed)}")
     print(f"Remaining to process:  {len(remaining_refs)}")
+    if pending_batches:
+        print(f"Pending batches:       {len(pending_batches)} "
+              f"({len(remaining_refs) - len(uncovered_refs)} remaining references)")
     print("=" * 70)
 
     if not remaining_refs:
+        if pending_batches:
+            # Nothing left for the pending batches to provide
+            save_progress(progress_file, {
+                'completed': True,
+                'total_processed': len(completed),
+                'completed_at': datetime.now().isoformat()
+            })
         print("\n✓ All references already processed!")
         return
 
-    # Ask for confirmation
-    response = input(f"\nProcess {len(remaining_refs)} references? (y/n): ")
-    if response.lower() != 'y':
-        print("Cancelled.")
+    if direct and pending_batches:
+        print("\nAn interrupted batch run still has pending batches.")
+        print("Run without --direct to collect their results first:")
+        print(f"  python3 {sys.argv[0]}")
         return
 
+    # Ask for confirmation before submitting new requests
+    if uncovered_refs:
+        response = input(f"\nProcess {len(uncovered_refs)} references? (y/n): ")
+        if response.lower() != 'y':
+            print("Cancelled.")
+            return
+
     # Process references
     print(f"\nStarting processing...\n")
-    success_count = 0
-    error_count = 0
     start_time = time.time()
-
-    for idx, (line_num, reference) in enumerate(remaining_refs, start=1):
-        # Show progress every 10 references
-        if idx % 10 == 0 or idx == 1:
-            elapsed = time.time() - start_time
-            rate = idx / elapsed if elapsed > 0 else 0
-            eta_seconds = (len(remaining_refs) - idx) / rate if rate > 0 else 0
-            eta_mins = eta_seconds / 60
-
-            print(f"Processing reference {idx}/{len(remaining_refs)} (line {line_num})...")
-            print(f"  Progress: {(idx/len(remaining_refs)*100):.1f}% | "
-                  f"Rate: {rate:.1f} ref/s | ETA: {eta_mins:.1f} min")
-
-        # Create output filename
-        output_file = json_dir / f"reference_{line_num:04d}.json"
-
-        # Process the reference
-        result, error = process_reference(client, reference, line_num)
-
-        if result is not None:
-            save_json(result, output_file)
-            success_count += 1
-            if idx % 10 != 0:
-                print(f"  ✓ Line {line_num}")
-        else:
-            log_error(error_log, line_num, reference, error)
-            error_count += 1
-            print(f"  ✗ Line {line_num}: {error}")
-
-        # Save progress periodically
-        if idx % 50 == 0:
-            stats = {
-                'last_processed_line': line_num,
-                'total_processed': len(completed) + success_count,
-                'total_errors': error_count,
-                'last_update': datetime.now().isoformat()
-            }
-            save_progress(progress_file, stats)
-
-        # Rate limiting: small delay between requests
-        time.sleep(0.5)
+    cache = ResponseCache(cache_file)
+    io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS)
+    if jsonl:
+        jsonl_writer = JsonlWriter(jsonl_file)
+        save_result = jsonl_writer.save_result
+    else:
+        save_result = json_file_saver(json_dir)
+
+    if direct:
+        success_count, error_count = asyncio.run(process_direct(
+            client, cache, io_pool, remaining_refs, save_result, error_log, progress_file, completed
+        ))
+    else:
+        if pending_batches:
+            print("Resuming pending batches...")
+
+        uncached_refs = save_cached_results(cache, uncovered_refs, save_result)
+        cached_count = len(uncovered_refs) - len(uncached_refs)
+        if cached_count:
+            print(f"Saved {cached_count} results from the cache")
+
+        if uncached_refs:
+            print("Submitting references to the Message Batches API...")
+            submit_batches(client, uncached_refs, pending_batches, progress_file)
+
+        success_count, error_count = process_batches(
+            client, cache, io_pool, pending_batches, remaining_refs, save_result, error_log
+        )
+        success_count += cached_count
+
+    io_pool.shutdown(wait=True)
+    if jsonl:
+        jsonl_writer.close()
+    cache.close()
 
     # Final summary
     elapsed_total = time.time() - start_time
@@ -242,7 +585,10 @@ def main():
     print(f"Average rate:            {len(remaining_refs)/elapsed_total:.2f} ref/second")
     if error_count > 0:
         print(f"\nError log:               {error_log}")
-    print(f"Output directory:        {json_dir}")
+    if jsonl:
+        print(f"Output file:             {jsonl_file}")
+    else:
+        print(f"Output directory:        {json_dir}")
     print("=" * 70)
 
     # Save final progress
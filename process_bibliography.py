@@ -6,12 +6,15 @@ and generates JSON files for each reference.
 """
 
 import os
+import asyncio
 import json
 import sys
 import time
 from pathlib import Path
 from typing import Optional
 
+from json_io import save_json
+
 try:
     import anthropic
 except ImportError:
@@ -19,6 +22,9 @@ except ImportError:
     os.system(f"{sys.executable} -m pip install anthropic")
     import anthropic
 
+# Maximum number of requests in flight at once
+MAX_CONCURRENCY = 10
+
 
 def read_file(filepath: str) -> str:
     """Read file content."""
@@ -33,31 +39,35 @@ def get_references(filepath: str) -> list[tuple[int, str]]:
         for line_num, line in enumerate(f, start=1):
             # Remove the arrow prefix if present and strip whitespace
             reference = line.strip()
-            if reference and '→' in reference:
-                reference = reference.split('→', 1)[1].strip()
+            _, arrow, rest = reference.partition('→')
+            if arrow:
+                reference = rest.strip()
             if reference:  # Only add non-empty references
                 references.append((line_num, reference))
     return references
 
 
-def process_reference(client: anthropic.Anthropic, prompt_template: str, reference: str, max_retries: int = 3) -> Optional[dict]:
+async def process_reference(client: anthropic.AsyncAnthropic, prompt_block: dict, reference: str, max_retries: int = 3) -> Optional[dict]:
     """
     Process a single reference using Claude API.
     Returns the extracted JSON data or None if processing fails.
     """
-    # Combine the prompt template with the actual reference
-    full_prompt = f"{prompt_template}\n\n**Reference to process:**\n```\n{reference}\n```"
+    # Only the reference block is built per call; the prompt block is shared
+    content = [
+        prompt_block,
+        {"type": "text", "text": f"**Reference to process:**\n```\n{reference}\n```"}
+    ]
 
     for attempt in range(max_retries):
         try:
-            message = client.messages.create(
+            message = await client.messages.create(
                 model="claude-sonnet-4-5-20250929",
                 max_tokens=4096,
                 temperature=0,
                 messages=[
                     {
                         "role": "user",
-                        "content": full_prompt
+                        "content": content
                     }
                 ]
             )
@@ -79,7 +89,7 @@ def process_reference(client: anthropic.Anthropic, prompt_template: str, referen
             if attempt < max_retries - 1:
                 wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
                 print(f"  Rate limit hit, waiting {wait_time}s before retry...")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
             else:
                 raise
         except json.JSONDecodeError as e:
@@ -90,19 +100,13 @@ def process_reference(client: anthropic.Anthropic, prompt_template: str, referen
             if attempt < max_retries - 1:
                 wait_time = 2 ** attempt
                 print(f"  Error: {e}. Retrying in {wait_time}s...")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
             else:
                 raise
 
     return None
 
 
-def save_json(data: dict, output_path: str):
-    """Save JSON data to file with proper formatting."""
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-
 def log_error(error_log_path: str, line_number: int, reference: str, error_msg: str):
     """Log an error to the error log file."""
     with open(error_log_path, 'a', encoding='utf-8') as f:
@@ -111,6 +115,53 @@ def log_error(error_log_path: str, line_number: int, reference: str, error_msg:
         f.write(f"  Timestamp: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
 
 
+async def process_references(client: anthropic.AsyncAnthropic, prompt_block: dict,
+                             references: list[tuple[int, str]], json_dir: Path,
+                             error_log: Path) -> tuple[int, int]:
+    """
+    Process references with up to MAX_CONCURRENCY concurrent requests,
+    saving each result as soon as it completes.
+    Returns the success and error counts.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    total_refs = len(references)
+    success_count = 0
+    error_count = 0
+
+    async def worker(line_num: int, reference: str):
+        async with semaphore:
+            try:
+                result = await process_reference(client, prompt_block, reference)
+                return line_num, reference, result, None
+            except Exception as e:
+                return line_num, reference, None, f"{type(e).__name__}: {str(e)}"
+
+    tasks = [worker(line_num, reference) for line_num, reference in references]
+    for idx, task in enumerate(asyncio.as_completed(tasks), start=1):
+        line_num, reference, result, error_msg = await task
+
+        # Show progress every 10 references
+        if idx % 10 == 0 or idx == 1:
+            print(f"Processed reference {idx}/{total_refs}...")
+
+        # Create output filename with zero-padded line number
+        output_file = json_dir / f"reference_{line_num:04d}.json"
+
+        if result is not None:
+            # Save to JSON file
+            save_json(result, str(output_file))
+            success_count += 1
+            print(f"  ✓ Line {line_num} -> {output_file.name}")
+        else:
+            if error_msg is None:
+                error_msg = "Failed to parse JSON response from API"
+            log_error(str(error_log), line_num, reference, error_msg)
+            error_count += 1
+            print(f"  ✗ Line {line_num}: {error_msg}")
+
+    return success_count, error_count
+
+
 def main():
     """Main processing function."""
     # Setup paths
@@ -135,54 +186,26 @@ def main():
         sys.exit(1)
 
     # Initialize Anthropic client
-    client = anthropic.Anthropic(api_key=api_key)
+    client = anthropic.AsyncAnthropic(api_key=api_key)
 
     # Read prompt template
     print("Reading prompt template...")
     prompt_template = read_file(str(prompt_file))
 
+    # Built once and sent with every request; the template is the same on
+    # every call, so it is marked for prompt caching
+    prompt_block = {"type": "text", "text": prompt_template, "cache_control": {"type": "ephemeral"}}
+
     # Read references
     print("Reading references...")
     references = get_references(str(liste_file))
     total_refs = len(references)
     print(f"Found {total_refs} references to process.\n")
 
-    # Process each reference
-    success_count = 0
-    error_count = 0
-
-    for idx, (line_num, reference) in enumerate(references, start=1):
-        # Show progress every 10 references
-        if idx % 10 == 0 or idx == 1:
-            print(f"Processing reference {idx}/{total_refs}...")
-
-        # Create output filename with zero-padded line number
-        output_file = json_dir / f"reference_{line_num:04d}.json"
-
-        try:
-            # Process the reference
-            result = process_reference(client, prompt_template, reference)
-
-            if result is not None:
-                # Save to JSON file
-                save_json(result, str(output_file))
-                success_count += 1
-                print(f"  ✓ Line {line_num} -> {output_file.name}")
-            else:
-                error_msg = "Failed to parse JSON response from API"
-                log_error(str(error_log), line_num, reference, error_msg)
-                error_count += 1
-                print(f"  ✗ Line {line_num}: {error_msg}")
-
-        except Exception as e:
-            error_msg = f"{type(e).__name__}: {str(e)}"
-            log_error(str(error_log), line_num, reference, error_msg)
-            error_count += 1
-            print(f"  ✗ Line {line_num}: {error_msg}")
-
-        # Small delay to avoid rate limiting
-        if idx < total_refs:
-            time.sleep(0.5)
+    # Process the references concurrently
+    success_count, error_count = asyncio.run(
+        process_references(client, prompt_block, references, json_dir, error_log)
+    )
 
     # Final summary
     print(f"\n{'='*60}")
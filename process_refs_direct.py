@@ -6,6 +6,7 @@ for Claude to process directly in the conversation.
 
 import json
 import sys
+from itertools import islice
 from pathlib import Path
 
 
@@ -13,9 +14,10 @@ def read_references(filepath: str, start_line: int = 1, count: int = None):
     """Read references from file, optionally limiting range."""
     references = []
     with open(filepath, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, start=1):
-            if line_num < start_line:
-                continue
+        # Skip ahead to start_line without inspecting the earlier lines;
+        # a start_line below 1 reads from the first line
+        start_line = max(start_line, 1)
+        for line_num, line in enumerate(islice(f, start_line - 1, None), start=start_line):
             if count and len(references) >= count:
                 break
 
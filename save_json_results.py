@@ -9,6 +9,8 @@ import sys
 from pathlib import Path
 from datetime import datetime
 
+from json_io import save_json
+
 
 def save_results(json_data_list, start_line_num):
     """Save a list of JSON results to files."""
@@ -31,8 +33,7 @@ def save_results(json_data_list, start_line_num):
 
         try:
             output_file = json_dir / f"reference_{line_num:04d}.json"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(json_data, f, ensure_ascii=False, indent=2)
+            save_json(json_data, output_file)
 
             print(f"✓ Saved: {output_file.name}")
             success_count += 1